@@ -0,0 +1,22 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+from wispchat.api import WishChat
+
+from .data import COMPLETION_RESPONSE
+
+
+@pytest.fixture(autouse=True)
+def openai_create(monkeypatch):
+    # No test should reach the OpenAI API.
+    create = MagicMock(return_value=COMPLETION_RESPONSE)
+    monkeypatch.setattr("openai.ChatCompletion.create", create)
+    return create
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    # Keep the log file out of the repository.
+    WishChat.reconfigure_sink(str(tmp_path_factory.mktemp("logs") / "log_file.json"))
+    return WishChat(enable_logging=True)
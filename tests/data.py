@@ -0,0 +1,14 @@
+COMPLETION_RESPONSE = {
+    "id": "some_id",
+    "object": "chat.completion",
+    "created": 123,
+    "model": "gpt-3.5-turbo",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "content"},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
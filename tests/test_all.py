@@ -1,33 +1,71 @@
 import pytest
 import json
+import warnings
 
 from unittest.mock import patch, MagicMock
 
 from loguru import logger as loguru_logger
 
-from wispchat.api import WishChat
-from wispchat.schema import OpenAIResponse, OpenAIResponseChunk
+from pydantic import ValidationError
 
+from wispchat.api import WishChat, _verify_functions, _verify_options
+from wispchat.schema import (
+    ChunkChoice,
+    ChunkDelta,
+    CompletionOptions,
+    Function,
+    OpenAIResponse,
+    OpenAIResponseChunk,
+)
+from wispchat.sink import JsonSink
 
-@pytest.fixture
-def api():
-    return WishChat(enable_logging=True)
+from .data import COMPLETION_RESPONSE
 
 
 def test_override_system_tip(api):
-    with api.override_system_tip("New tip") as system_tip:
-        assert api._local.system_tip == "New tip"
-    assert getattr(api._local, "system_tip", api.system_tip) == api.system_tip
+    with api.override_system_tip("New tip"):
+        assert api._get_prompt() == "New tip"
+    assert api._get_prompt() == api._system_prompt
+
+
+def test_override_system_prompt_restores_on_error(api):
+    with pytest.raises(RuntimeError):
+        with api.override_system_prompt("New prompt"):
+            raise RuntimeError
+    assert api._get_prompt() == api._system_prompt
+
+
+def test_nested_override_system_prompt(api):
+    with api.override_system_prompt(None):
+        with api.override_system_prompt("New prompt"):
+            assert api._get_prompt() == "New prompt"
+        assert api._get_prompt() is None
+    assert api._get_prompt() == api._system_prompt
 
 
 def test_with_system_tip_decorator(api):
     @api.with_system_tip("New tip")
     def some_func():
-        return api._local.system_tip
+        return api._get_prompt()
 
     assert some_func() == "New tip"
 
 
+def test_log_sink_shared_between_instances(api):
+    sink_id = WishChat._sink_id
+    WishChat(enable_logging=True)
+    assert WishChat._sink_id == sink_id
+
+
+def test_reconfigure_sink_after_logger_remove(api, tmp_path):
+    path = tmp_path / "log_file.json"
+    loguru_logger.remove()
+    WishChat.reconfigure_sink(str(path))
+    api._log_response(0, [], {}, OpenAIResponse(**COMPLETION_RESPONSE))
+    WishChat.reconfigure_sink(str(tmp_path / "other_log_file.json"))
+    assert len(path.read_text().splitlines()) == 1
+
+
 def test_call_non_stream(api):
     mock_response = MagicMock()  # Assuming OpenAIResponse
     with patch.object(api, "completion", return_value=mock_response) as mock_method:
@@ -35,6 +73,14 @@ def test_call_non_stream(api):
         assert response == mock_response
 
 
+def test_call_keeps_options(api):
+    options = {"max_tokens": 50}
+    with patch.object(api, "completion") as mock_method:
+        api(["message"], options=options)
+    assert options == {"max_tokens": 50}
+    assert mock_method.call_args.args[1] == {"max_tokens": 50, "stream": False}
+
+
 def test_call_stream(api):
     mock_response_chunk = MagicMock()  # Assuming OpenAIResponseChunk
     with patch.object(
@@ -44,6 +90,16 @@ def test_call_stream(api):
         assert response[0] == mock_response_chunk
 
 
+def test_stream_warns_once():
+    api = WishChat()
+    with patch.object(api, "completion", return_value=iter([])):
+        with pytest.warns(UserWarning):
+            api.stream(["message"], options={"stream": False})
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            api.stream(["message"], options={"stream": False})
+
+
 def test_completion(api):
     options = {"stream": True}
     mock_response = MagicMock()  # Assuming OpenAIResponse
@@ -54,28 +110,56 @@ def test_completion(api):
         assert response == mock_response
 
 
-def test_call_openai_api(api):
+def test_verify_options():
+    options = {"max_tokens": 50, "temperature": 0.5, "stream": False}
+    assert _verify_options(options) == CompletionOptions(**options).dict(
+        exclude_none=True
+    )
+    assert _verify_options({"temperature": 1, "max_tokens": None}) == {
+        **CompletionOptions().dict(exclude_none=True),
+        "temperature": 1.0,
+    }
+    with pytest.raises(ValidationError):
+        _verify_options({"n": 0})
+
+
+def test_verify_options_cached():
+    options = {"n": 2, "stop": ["\n"], "logit_bias": {"50256": -100}}
+    assert _verify_options(options) is _verify_options(dict(options))
+    assert _verify_options({"n": 2}) is not _verify_options({"n": 2.0})
+
+
+def test_verify_functions():
+    functions = [{"name": "get_time", "parameters": {"type": "object"}}]
+    with patch("wispchat.api.Function", wraps=Function) as mock_function:
+        _verify_functions(functions)
+        _verify_functions([dict(function) for function in functions])
+    assert mock_function.call_count == 1
+    with pytest.raises(ValidationError):
+        _verify_functions(
+            [{"name": "not a valid name", "parameters": {"type": "object"}}]
+        )
+
+
+def test_call_openai_api(api, openai_create):
     messages = [{"role": "user", "content": "message"}]
     api_params = {"stream": False}
-    mock_create_response = {
-        "id": "some_id",
-        "object": "chat.completion",
-        "created": 123,
-        "model": "gpt-3.5-turbo",
-        "choices": [
-            {
-                "index": 0,
-                "message": {"role": "system", "content": "content"},
-                "finish_reason": "stop",
-            }
-        ],  # Added finish_reason
-        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
-    }
-    with patch(
-        "openai.ChatCompletion.create", return_value=mock_create_response
-    ) as mock_create:
-        response = api._call_openai_api(messages, api_params)
-        assert isinstance(response, OpenAIResponse)
+    response = api._call_openai_api(messages, {**api_params, "stop": None})
+    assert isinstance(response, OpenAIResponse)
+    assert "stop" not in openai_create.call_args.kwargs
+
+
+def test_response_contents_after_copy():
+    response = OpenAIResponse(**COMPLETION_RESPONSE)
+    assert response.contents == ["content"]
+    choice = response.first_choice.copy(
+        update={
+            "message": response.first_choice.message.copy(update={"content": "other"})
+        }
+    )
+    updated_response = response.copy(update={"choices": [choice]})
+    assert updated_response.contents == ["other"]
+    assert updated_response.contents == [updated_response.first]
 
 
 def test_convert_to_response_chunks(api):
@@ -94,13 +178,95 @@ def test_convert_to_response_chunks(api):
     assert isinstance(converted_chunks[0], OpenAIResponseChunk)
 
 
+def test_response_chunk_reuses_choices():
+    choice = ChunkChoice(index=0, delta=ChunkDelta(content="content"))
+    chunk = OpenAIResponseChunk(
+        id="some_id",
+        object="chat.completion.chunk",
+        created=123,
+        model="gpt-3.5-turbo",
+        choices=[choice],
+    )
+    assert chunk.choices[0] is choice
+    with pytest.raises(TypeError):
+        chunk.id = "other_id"
+
+
+def test_convert_to_response_chunks_matches_validation(api):
+    chunk = {
+        "id": "some_id",
+        "object": "chat.completion.chunk",
+        "created": 123,
+        "model": "gpt-3.5-turbo",
+        "choices": [
+            {
+                "index": 0,
+                "delta": {
+                    "role": "assistant",
+                    "function_call": {"name": "get_current_weather", "arguments": ""},
+                },
+                "finish_reason": None,
+            }
+        ],
+    }
+    (converted_chunk,) = api._convert_to_response_chunks(iter([chunk]))
+    assert converted_chunk == OpenAIResponseChunk(**chunk)
+
+
 def test_log_response(api):
-    with patch.object(loguru_logger, "info") as mock_logger:
+    messages = []
+    sink_id = loguru_logger.add(messages.append, format="{message}")
+    try:
         api._log_response(0, [], {}, MagicMock())  # Assuming OpenAIResponse
-        mock_logger.assert_called_once()
+    finally:
+        loguru_logger.remove(sink_id)
+    assert len(messages) == 1
+    assert "payload" in messages[0].record["extra"]
+
+
+def test_log_response_str_keys(api):
+    messages = []
+    sink_id = loguru_logger.add(messages.append, format="{message}")
+    try:
+        api._log_response(0, [], {"logit_bias": {50256: -100}}, MagicMock())
+    finally:
+        loguru_logger.remove(sink_id)
+    payload = messages[0].record["extra"]["payload"]
+    assert payload["request"]["options"]["logit_bias"] == {"50256": -100}
+
+
+def test_json_sink(tmp_path):
+    path = tmp_path / "log_file.json"
+    sink_id = loguru_logger.add(
+        JsonSink(str(path)), filter=lambda record: "payload" in record["extra"]
+    )
+    try:
+        loguru_logger.bind(payload={"errors": None}).info("")
+        loguru_logger.info("not a payload")
+    finally:
+        loguru_logger.remove(sink_id)
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [
+        {"errors": None}
+    ]
+
+
+def test_json_sink_snapshots_payload(api, tmp_path):
+    path = tmp_path / "log_file.json"
+    functions = [{"name": "get_time", "parameters": {"type": "object"}}]
+    sink_id = loguru_logger.add(
+        JsonSink(str(path)), filter=lambda record: "payload" in record["extra"]
+    )
+    try:
+        api(["message"], functions=functions)
+        functions[0]["name"] = "changed_after_call"
+    finally:
+        loguru_logger.remove(sink_id)
+    (line,) = path.read_text().splitlines()
+    logged_functions = json.loads(line)["request"]["options"]["functions"]
+    assert logged_functions[0]["name"] == "get_time"
 
 
-def test_call_with_function(api):
+def test_call_with_function(api, openai_create):
     mock_function_response = {
         "name": "get_current_weather",
         "arguments": json.dumps(
@@ -127,33 +293,31 @@ def test_call_with_function(api):
         "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
     }
 
-    with patch(
-        "openai.ChatCompletion.create", return_value=mock_openai_response
-    ) as mock_openai_create:
-        response = api(
-            ["What's the weather like in San Francisco, CA?"],
-            functions=[
-                {
-                    "name": "get_current_weather",
-                    "description": "Get the current weather in a given location",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "location": {
-                                "type": "string",
-                                "description": "The city and state, e.g. San Francisco, CA",
-                            },
-                            "unit": {
-                                "type": "string",
-                                "enum": ["celsius", "fahrenheit"],
-                            },
+    openai_create.return_value = mock_openai_response
+    response = api(
+        ["What's the weather like in San Francisco, CA?"],
+        functions=[
+            {
+                "name": "get_current_weather",
+                "description": "Get the current weather in a given location",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {
+                            "type": "string",
+                            "description": "The city and state, e.g. San Francisco, CA",
+                        },
+                        "unit": {
+                            "type": "string",
+                            "enum": ["celsius", "fahrenheit"],
                         },
-                        "required": ["location"],
                     },
-                }
-            ],
-        )
+                    "required": ["location"],
+                },
+            }
+        ],
+    )
 
-    assert mock_openai_create.called
+    assert openai_create.called
     assert response.first_choice.message.function_call is not None
     assert response.first_choice.message.function_call == mock_function_response
@@ -5,12 +5,13 @@ import threading
 import warnings
 
 from contextlib import contextmanager
-from typing import Any, Dict, Iterator, List, Optional
+from typing import Any, ClassVar, Dict, Hashable, Iterator, List, Optional, Set
 
 import openai
 import openai.error
 
 from loguru import logger
+from pydantic.fields import SHAPE_SINGLETON
 from tenacity import (
     retry,
     retry_if_exception_type,
@@ -18,15 +19,138 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from .schema import CompletionOptions, OpenAIResponse, OpenAIResponseChunk, Function
+from .schema import (
+    ChunkChoice,
+    ChunkDelta,
+    CompletionOptions,
+    Function,
+    FunctionCall,
+    OpenAIResponse,
+    OpenAIResponseChunk,
+)
+from .sink import JsonSink
 
 
 SUPPORTED_API_TYPES = ["openai", "azure"]
 API_TYPE_AZURE = "azure"
 API_TYPE_OPENAI = "openai"
 
+_INFO_LEVEL_NO = logger.level("INFO").no
+
+# Marks the absence of a value where None is a valid value.
+_MISSING = object()
+
+_OPT_FIELDS = CompletionOptions.__fields__
+_DEFAULT_OPTIONS = CompletionOptions().dict(exclude_none=True)
+# Options whose value can be verified with a plain type check instead of pydantic.
+_OPT_SIMPLE_TYPES = {
+    name: field.type_
+    for name, field in _OPT_FIELDS.items()
+    if field.shape == SHAPE_SINGLETON and field.type_ in (bool, int, float, str)
+}
+# Verified options by their frozen key; shared between calls, so they must not be mutated.
+_VERIFIED_OPTIONS: Dict[Hashable, Dict[str, Any]] = {}
+_VERIFIED_OPTIONS_MAX_SIZE = 256
+# Frozen keys of function lists that passed validation.
+_VERIFIED_FUNCTIONS: Set[Hashable] = set()
+_VERIFIED_FUNCTIONS_MAX_SIZE = 256
+
+
+def _verify_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Verifies completion options and returns them merged with the defaults.
+    Options that only set simple fields to values of the exact field type skip pydantic validation,
+    and other options are only validated the first time they are seen.
+    The returned dict may be shared between calls and must not be mutated.
+    """
+    if options.keys() <= _OPT_SIMPLE_TYPES.keys() and all(
+        type(value) is _OPT_SIMPLE_TYPES[name]
+        or (value is None and _OPT_FIELDS[name].allow_none)
+        for name, value in options.items()
+    ):
+        return {**_DEFAULT_OPTIONS, **options}
+
+    # Anything else is validated once per distinct set of options.
+    try:
+        key = _freeze(options)
+        verified_options = _VERIFIED_OPTIONS.get(key)
+    except TypeError:
+        return CompletionOptions(**options).dict(exclude_none=True)
+    if verified_options is None:
+        verified_options = CompletionOptions(**options).dict(exclude_none=True)
+        if len(_VERIFIED_OPTIONS) >= _VERIFIED_OPTIONS_MAX_SIZE:
+            _VERIFIED_OPTIONS.clear()
+        _VERIFIED_OPTIONS[key] = verified_options
+    return verified_options
+
+
+def _verify_functions(functions: List[Dict[str, Any]]):
+    """
+    Validates function definitions, skipping lists that were already validated.
+    The definitions themselves are sent to the API unchanged.
+    """
+    try:
+        key = _freeze(functions)
+        if key in _VERIFIED_FUNCTIONS:
+            return
+    except TypeError:
+        key = None
+    for function in functions:
+        Function(**function)
+    if key is not None:
+        if len(_VERIFIED_FUNCTIONS) >= _VERIFIED_FUNCTIONS_MAX_SIZE:
+            _VERIFIED_FUNCTIONS.clear()
+        _VERIFIED_FUNCTIONS.add(key)
+
+
+def _freeze(value: Any) -> Hashable:
+    """
+    Converts options or function definitions into a hashable key. Scalars are paired
+    with their type so that equal values of different types, such as 1 and True,
+    do not share a key.
+    """
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return type(value), value
+
+
+def _construct_chunk(chunk: Dict[str, Any]) -> OpenAIResponseChunk:
+    """
+    Builds an OpenAIResponseChunk from a chunk returned by the API without validating it.
+    """
+    choices = []
+    for choice in chunk["choices"]:
+        delta = choice["delta"]
+        function_call = delta.get("function_call")
+        choices.append(
+            ChunkChoice.construct(
+                index=choice["index"],
+                delta=ChunkDelta.construct(
+                    role=delta.get("role"),
+                    content=delta.get("content"),
+                    function_call=FunctionCall.construct(**function_call)
+                    if function_call
+                    else None,
+                ),
+                finish_reason=choice.get("finish_reason"),
+            )
+        )
+    return OpenAIResponseChunk.construct(
+        id=chunk["id"],
+        object=chunk["object"],
+        created=chunk["created"],
+        model=chunk["model"],
+        choices=choices,
+    )
+
 
 class WishChat:
+    # The log sink is shared by all instances so each record is only written once.
+    _sink_id: ClassVar[Optional[int]] = None
+    _sink_lock: ClassVar[threading.Lock] = threading.Lock()
+
     def __init__(
         self,
         model_name: str = "gpt-3.5-turbo",
@@ -37,6 +161,7 @@ class WishChat:
         api_version: Optional[str] = os.environ.get("OPENAI_API_VERSION"),
         system_prompt: str = "You are a helpful assistant.",
         enable_logging: bool = False,
+        validate_chunks: bool = False,
     ):
         if api_type not in SUPPORTED_API_TYPES:
             raise ValueError(
@@ -55,29 +180,79 @@ class WishChat:
         self.model_name = model_name
         self.depolyment_id = depolyment_id
         self._system_prompt = system_prompt
+        # Shared by every request made with the default system prompt; never mutated.
+        self._system_messages = (
+            ({"role": "system", "content": system_prompt},) if system_prompt else ()
+        )
         self.enable_logging = enable_logging
-        self._local = threading.local()
+        self.validate_chunks = validate_chunks
+        self._stream_warned = False
+        # System prompt overrides, keyed by the id of the thread that set them.
+        self._prompt_overrides: Dict[int, Optional[str]] = {}
+
+        if enable_logging and WishChat._sink_id is None:
+            with WishChat._sink_lock:
+                if WishChat._sink_id is None:
+                    WishChat._sink_id = WishChat._add_sink("log_file.json")
+
+    @staticmethod
+    def reconfigure_sink(path: str = "log_file.json"):
+        """
+        Replaces the log sink shared by all instances with one writing to the given file.
+        Call it again after a global logger.remove(), which also removes this sink;
+        instances created afterwards do not re-install it on their own.
 
-        if enable_logging:
-            logger.add("log_file.json", format="{message}", serialize=True)
+        Args:
+            path (str): The file to append the log records to.
+
+        Usage:
+            WishChat.reconfigure_sink("logs/wispchat.json")
+        """
+        with WishChat._sink_lock:
+            if WishChat._sink_id is not None:
+                try:
+                    logger.remove(WishChat._sink_id)
+                except ValueError:
+                    # The sink was already removed, e.g. by logger.remove().
+                    pass
+            WishChat._sink_id = WishChat._add_sink(path)
+
+    @staticmethod
+    def _add_sink(path: str) -> int:
+        return logger.add(
+            JsonSink(path),
+            format="{message}",
+            level="INFO",
+            filter=lambda record: "payload" in record["extra"],
+        )
 
     @contextmanager
-    def override_system_prompt(self, new_prompt: str):
+    def override_system_prompt(self, new_prompt: Optional[str]):
         """
         Temporarily overrides the system prompt for a specific block of code.
         This is useful for changing the behavior of the model within a specific context.
 
         Args:
-            new_prompt (str): The new system prompt to use within the context.
+            new_prompt (Optional[str]): The new system prompt to use within the context,
+                or None to send no system message.
 
         Usage:
             with api.override_system_prompt("You are a dog."):
                 # Code here will use the new system prompt
         """
-        original_prompt = getattr(self._local, "system_prompt", self._system_prompt)
-        self._local.system_prompt = new_prompt
-        yield
-        self._local.system_prompt = original_prompt
+        thread_id = threading.get_ident()
+        original_prompt = self._prompt_overrides.get(thread_id, _MISSING)
+        self._prompt_overrides[thread_id] = new_prompt
+        try:
+            yield
+        finally:
+            if original_prompt is _MISSING:
+                del self._prompt_overrides[thread_id]
+            else:
+                self._prompt_overrides[thread_id] = original_prompt
+
+    def _get_prompt(self) -> Optional[str]:
+        return self._prompt_overrides.get(threading.get_ident(), self._system_prompt)
 
     def system_prompt(self, prompt: str):
         """
@@ -102,6 +277,10 @@ class WishChat:
 
         return decorator
 
+    # Aliases kept for code written against the earlier "system tip" names.
+    override_system_tip = override_system_prompt
+    with_system_tip = system_prompt
+
     def __call__(
         self,
         user_messages: List[str],
@@ -132,10 +311,8 @@ class WishChat:
                 "The 'stream' option is not allowed in this method. Use the 'stream' method for streaming."
             )
 
-        # Ensure that the 'stream' option is set to False
-        if options is None:
-            options = {}
-        options["stream"] = False
+        # Ensure that the 'stream' option is set to False, without changing the caller's dict
+        options = {**options, "stream": False} if options else {"stream": False}
 
         return self.completion(
             user_messages, options, functions=functions, system_prompt=system_prompt
@@ -164,15 +341,15 @@ class WishChat:
             for chunk in api.stream(user_messages, options={"max_tokens": 50}):
                 print(chunk.first)
         """
-        if options and options.get("stream") is False:
+        if options and options.get("stream") is False and not self._stream_warned:
             warnings.warn(
-                "The 'stream' option is ignored in 'stream' method; it always operates in streaming mode."
+                "The 'stream' option is ignored in 'stream' method; it always operates in streaming mode.",
+                stacklevel=2,
             )
+            self._stream_warned = True
 
-        # Ensure that the 'stream' option is set to True
-        if options is None:
-            options = {}
-        options["stream"] = True
+        # Ensure that the 'stream' option is set to True, without changing the caller's dict
+        options = {**options, "stream": True} if options else {"stream": True}
 
         return self.completion(user_messages, options, system_prompt)
 
@@ -198,37 +375,38 @@ class WishChat:
         It verifies the provided options, constructs the messages (including a system message if a prompt is provided),
         and calls the OpenAI API with these messages.
         """
-        verified_options = CompletionOptions(**options) if options else None
-        verified_functions = (
-            [Function(**function) for function in functions] if functions else None
-        )
-
-        system_prompt = system_prompt or getattr(
-            self._local, "system_prompt", self._system_prompt
-        )
+        api_params = _verify_options(options) if options else {}
+        if functions:
+            _verify_functions(functions)
 
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        for content in user_messages:
-            messages.append({"role": "user", "content": content})
+        system_prompt = system_prompt or self._get_prompt()
 
-        response = self._call_openai_api(
-            messages, vars(verified_options) if options else {}, functions
+        if system_prompt is self._system_prompt:
+            messages = list(self._system_messages)
+        elif system_prompt:
+            messages = [{"role": "system", "content": system_prompt}]
+        else:
+            messages = []
+        messages.extend(
+            {"role": "user", "content": content} for content in user_messages
         )
 
+        response = self._call_openai_api(messages, api_params, functions)
+
         return response
 
     @retry(
         reraise=True,
         wait=wait_random_exponential(min=1, max=60),
         stop=stop_after_attempt(6),
-        retry=(
-            retry_if_exception_type(openai.error.Timeout)
-            | retry_if_exception_type(openai.error.APIError)
-            | retry_if_exception_type(openai.error.APIConnectionError)
-            | retry_if_exception_type(openai.error.RateLimitError)
-            | retry_if_exception_type(openai.error.ServiceUnavailableError)
+        retry=retry_if_exception_type(
+            (
+                openai.error.Timeout,
+                openai.error.APIError,
+                openai.error.APIConnectionError,
+                openai.error.RateLimitError,
+                openai.error.ServiceUnavailableError,
+            )
         ),
     )
     def _call_openai_api(
@@ -241,7 +419,11 @@ class WishChat:
             function_call = "auto"
         else:
             function_call = "none"
-        start_time = time.perf_counter()
+        start_time = time.perf_counter() if self.enable_logging else None
+        # Unset options are left out of the request rather than sent as null.
+        api_params = {
+            key: value for key, value in api_params.items() if value is not None
+        }
         if functions:
             api_params["functions"] = functions
             api_params["function_call"] = function_call
@@ -261,18 +443,29 @@ class WishChat:
             self._log_response(start_time, messages, api_params, response_data)
             return response_data
 
-    @staticmethod
-    def _convert_to_response_chunks(openai_generator: Iterator):
-        for chunk in openai_generator:
-            chunk_object = OpenAIResponseChunk(**chunk)
-            yield chunk_object
+    def _convert_to_response_chunks(self, openai_generator: Iterator):
+        # Streamed chunks come straight from the API, so they are only validated on request.
+        if self.validate_chunks:
+            for chunk in openai_generator:
+                yield OpenAIResponseChunk(**chunk)
+        else:
+            for chunk in openai_generator:
+                yield _construct_chunk(chunk)
 
     def _log_response(self, start_time, messages, api_params, response_data):
-        if not self.enable_logging:
+        # Skip building the payload entirely when no sink accepts INFO records.
+        if not self.enable_logging or logger._core.min_level > _INFO_LEVEL_NO:
             return
 
         end_time = time.perf_counter()
         response_time = end_time - start_time
+        logit_bias = api_params.get("logit_bias")
+        if logit_bias:
+            # Keep the payload str-keyed so orjson can serialize it without OPT_NON_STR_KEYS.
+            api_params = {
+                **api_params,
+                "logit_bias": {str(token): bias for token, bias in logit_bias.items()},
+            }
         log_info = {
             "timestamp": start_time,
             "request": {
@@ -284,4 +477,4 @@ class WishChat:
             "analysis": {"response_time": response_time},
             "errors": None,
         }
-        logger.info(log_info)
+        logger.bind(payload=log_info).info("OpenAI API response")
@@ -16,7 +16,7 @@ class CompletionOptions(BaseModel):
     stream: bool = False
     frequency_penalty: float = 0.0
     presence_penalty: float = 0.0
-    logit_bias: Optional[Dict[str, float]] = Field(default_factory=dict)
+    logit_bias: Optional[Dict[str, float]] = None
 
 
 from typing import Any, Union
@@ -64,13 +64,24 @@ class Usage(BaseModel):
     total_tokens: int
 
 
-class ChunkDelta(BaseModel):
+class ChunkModel(BaseModel):
+    """
+    Base class for the models built for every streamed chunk.
+    They are read-only, so nested instances are reused instead of copied on validation.
+    """
+
+    class Config:
+        copy_on_model_validation = "none"
+        allow_mutation = False
+
+
+class ChunkDelta(ChunkModel):
     role: Optional[str] = None
     content: Optional[str] = None
     function_call: Optional[FunctionCall] = None
 
 
-class ChunkChoice(BaseModel):
+class ChunkChoice(ChunkModel):
     index: int
     delta: ChunkDelta
     finish_reason: Optional[str] = None
@@ -98,7 +109,7 @@ class OpenAIResponse(BaseModel):
         return self.choices[0]
 
 
-class OpenAIResponseChunk(BaseModel):
+class OpenAIResponseChunk(ChunkModel):
     id: str
     object: str
     created: int
@@ -0,0 +1,102 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional dependency
+    orjson = None
+
+
+_STOP = object()
+
+
+def dumps(obj: object) -> bytes:
+    """
+    Serializes an object to JSON bytes, using orjson when it is installed.
+    Values that are not JSON serializable are converted with str().
+    Dict keys must be strings; orjson's slower OPT_NON_STR_KEYS mode is not used.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, ensure_ascii=False).encode()
+
+
+class JsonSink:
+    """
+    A loguru sink that appends the "payload" bound to each record as one line of JSON.
+
+    Payloads are serialized on the logging thread, so later changes to objects they
+    reference do not reach the file. The resulting lines are queued and written by a
+    background thread in batches of up to `batch_size` records, or whatever has
+    accumulated after `flush_interval` seconds, with a single write per batch.
+    Pending records are written when the sink is stopped or the interpreter exits.
+
+    Args:
+        path (str): The file to append the log lines to.
+        batch_size (int): The maximum number of records written at once.
+        flush_interval (float): The maximum number of seconds a record waits to be written.
+
+    Usage:
+        logger.add(JsonSink("log_file.json"), filter=lambda record: "payload" in record["extra"])
+        logger.bind(payload={"key": "value"}).info("...")
+    """
+
+    def __init__(self, path: str, batch_size: int = 50, flush_interval: float = 1.0):
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def write(self, message):
+        self._queue.put(dumps(message.record["extra"]["payload"]) + b"\n")
+
+    def stop(self):
+        if self._fd is None:
+            return
+        atexit.unregister(self.stop)
+        self._queue.put(_STOP)
+        self._thread.join()
+        os.close(self._fd)
+        self._fd = None
+
+    def _drain(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                line = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(batch)
+                batch = []
+                continue
+
+            if line is _STOP:
+                self._write(batch)
+                return
+
+            if not batch:
+                deadline = time.monotonic() + self._flush_interval
+            batch.append(line)
+            if len(batch) >= self._batch_size:
+                self._write(batch)
+                batch = []
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            data = memoryview(b"".join(batch))
+            while data:
+                data = data[os.write(self._fd, data) :]
+        except Exception:
+            # Keep the drain thread alive; a lost batch must not stop logging.
+            traceback.print_exc()